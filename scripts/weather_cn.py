@@ -13,19 +13,28 @@
 
 from __future__ import annotations
 
-import argparse
-import fcntl
+import functools
+import http.client
+import itertools
 import json
 import os
 import re
-import tempfile
+import sqlite3
+import stat
+import sys
+import threading
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖, 缺失时回退到标准库 json
+    orjson = None
 
 
 SKYCON_MAP = {
@@ -51,64 +60,204 @@ SKYCON_MAP = {
     "WIND": "大风",
 }
 
+_SKYCON_GET = SKYCON_MAP.get
+
 WEEKDAY_CN = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
 
 DEFAULT_DAYS = 7
 
+# _run() 的默认配置, 与命令行参数一一对应 (place 必填)
+DEFAULT_CONFIG: Dict[str, Any] = {
+    "cache_dir": "cache",
+    "weather_cache_dir": None,
+    "geo_ttl_hours": 24 * 30,
+    "weather_ttl_minutes": 10,
+    "timeout": 8,
+    "retries": 2,
+    "amap_key": "",
+    "caiyun_token": "",
+    "detail": "basic",
+    "format": "text",
+    "hourly_steps": 24,
+    "raw_caiyun": False,
+    "mock": False,
+    "debug": False,
+}
+
+_PLACE_TRAILING_CHARS = frozenset("，。,.;；：:、")
+
+_RE_MASK_KEY = re.compile(r"([?&]key=)[^&]+")
+_RE_MASK_V2 = re.compile(r"/v2(?:\.\d+)?/[^/]+/")
+_RE_HHMM_TAIL = re.compile(r"\d{2}:\d{2}$")
+
+# 缓存值默认紧凑存储; 调试时可设置 WEATHER_CN_PRETTY_CACHE=1 以缩进格式写入
+_PRETTY_CACHE = bool(os.environ.get("WEATHER_CN_PRETTY_CACHE"))
+
+_HTTP_HEADERS = {"User-Agent": "weather-cn-skill-debug/0.1"}
+# 按 (scheme, host) 复用的长连接, 避免每次请求 (含重试) 重新握手 TLS.
+# http.client 连接不是线程安全的, 因此每个线程各自持有一组连接
+_HTTP_LOCAL = threading.local()
+
+
+def json_loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(obj: Any, indent: bool = False) -> bytes:
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _connect_cache_db(path: Path, durable: bool) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        # tmpfs 上 fsync 没有意义, 直接关闭同步
+        conn.execute("PRAGMA synchronous=NORMAL" if durable else "PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE IF NOT EXISTS kv(k TEXT PRIMARY KEY, ts REAL, v BLOB)")
+        # 建表后不再等待锁: 写入遇到并发直接跳过 (见 SqliteCache.set)
+        conn.execute("PRAGMA busy_timeout=0")
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def open_cache_db(path: Path, durable: bool = True) -> Optional[sqlite3.Connection]:
+    """打开缓存数据库; 不可用时打印警告并返回 None (调用方按无缓存处理)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        return _connect_cache_db(path, durable)
+    except sqlite3.OperationalError as exc:
+        # 无权限/被锁等: 文件本身可能完好, 不能删除
+        print(f"[warn] 缓存数据库不可用 ({exc}): {path}", file=sys.stderr)
+        return None
+    except sqlite3.DatabaseError as exc:
+        # 文件损坏或不是 SQLite 数据库: 与旧版 JSON 缓存一样视为空缓存, 删除后重建
+        print(f"[warn] 缓存数据库已损坏, 重建 ({exc}): {path}", file=sys.stderr)
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.unlink(f"{path}{suffix}")
+        except FileNotFoundError:
+            pass
+        except OSError:
+            break
+    try:
+        return _connect_cache_db(path, durable)
+    except sqlite3.Error as exc:
+        print(f"[warn] 缓存数据库重建失败 ({exc}): {path}", file=sys.stderr)
+        return None
+
+
+def _is_lock_contention(exc: sqlite3.Error) -> bool:
+    code = getattr(exc, "sqlite_errorcode", None)
+    if code is None:
+        # Python < 3.11 没有错误码, 只能按错误信息判断
+        return "database is locked" in str(exc) or "database table is locked" in str(exc)
+    return (code & 0xFF) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
 
-class JsonCache:
-    def __init__(self, path: Path) -> None:
-        self.path = path
-        self.lock_path = Path(f"{path}.lock")
-        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+class SqliteCache:
+    def __init__(self, conn: Optional[sqlite3.Connection], debug: bool = False) -> None:
+        # 同一数据库文件的多个缓存共享一个连接; conn 为 None 时不做缓存
+        self.conn = conn
+        self.debug = debug
 
     def get(self, key: str, ttl_seconds: int) -> Optional[Any]:
-        data = self._safe_load()
-        item = data.get(key)
-        if not item:
+        if self.conn is None:
+            return None
+        try:
+            row = self.conn.execute("SELECT ts, v FROM kv WHERE k = ?", (key,)).fetchone()
+        except sqlite3.Error:
             return None
-        ts = item.get("ts", 0)
-        if time.time() - ts > ttl_seconds:
+        if not row:
+            return None
+        ts, raw = row
+        if time.time() - (ts or 0) > ttl_seconds:
+            return None
+        try:
+            return json_loads(raw)
+        except ValueError:
             return None
-        return item.get("value")
 
     def set(self, key: str, value: Any) -> None:
-        with self.lock_path.open("a+") as lock_file:
-            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
-            data = self._safe_load()
-            data[key] = {"ts": time.time(), "value": value}
-            self._atomic_write(data)
-            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
-
-    def _safe_load(self) -> Dict[str, Any]:
-        if not self.path.exists():
-            return {}
+        if self.conn is None:
+            return
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?, ?)",
+                (key, time.time(), json_dumps(value, indent=_PRETTY_CACHE)),
+            )
+        except sqlite3.Error as exc:
+            if _is_lock_contention(exc):
+                # 其他进程正在写入: 调用方已拿到最新数据, 本次跳过缓存更新即可
+                if self.debug:
+                    print(f"[debug] cache busy ({exc}), skip write: {key}")
+                return
+            # 只读/磁盘错误等不会自行恢复, 需要让用户看到; 本次查询结果仍然正常输出
+            print(f"[warn] 缓存写入失败 ({exc}): {key}", file=sys.stderr)
+
+
+def default_weather_cache_dir() -> Optional[Path]:
+    # 不同发行版的共享内存挂载点不同: /dev/shm 或 /run/shm.
+    # 该目录所有用户可写, 固定名称可能被他人抢先创建: 只接受当前用户拥有、
+    # 非符号链接、组/其他用户不可写的真实目录, 否则返回 None
+    uid = os.getuid()
+    for base in (Path("/dev/shm"), Path("/run/shm")):
+        if not base.is_dir():
+            continue
+        path = base / f"weather-cn-{uid}"
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+        except OSError:
+            return None
         try:
-            with self.path.open("r", encoding="utf-8") as f:
-                obj = json.load(f)
-            if isinstance(obj, dict):
-                return obj
-            return {}
-        except (OSError, json.JSONDecodeError):
-            return {}
-
-    def _atomic_write(self, obj: Dict[str, Any]) -> None:
-        self.path.parent.mkdir(parents=True, exist_ok=True)
-        with tempfile.NamedTemporaryFile(
-            "w", encoding="utf-8", dir=self.path.parent, delete=False
-        ) as tmp:
-            json.dump(obj, tmp, ensure_ascii=False, indent=2)
-            tmp.flush()
-            os.fsync(tmp.fileno())
-            temp_name = tmp.name
-        os.replace(temp_name, self.path)
+            st = os.lstat(path)
+        except OSError:
+            return None
+        if stat.S_ISDIR(st.st_mode) and st.st_uid == uid and not st.st_mode & 0o022:
+            return path
+        return None
+    return None
+
+
+def is_tmpfs_path(path: Path) -> bool:
+    target = str(path.resolve())
+    best_mount = ""
+    best_fstype = ""
+    try:
+        with open("/proc/self/mounts", "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point, fstype = fields[1], fields[2]
+                prefix = mount_point.rstrip("/") + "/"
+                if (target == mount_point or target.startswith(prefix)) and len(mount_point) > len(best_mount):
+                    best_mount, best_fstype = mount_point, fstype
+    except OSError:
+        return False
+    return best_fstype == "tmpfs"
 
 
 def normalize_place(place: str) -> str:
-    place = re.sub(r"\s+", "", place)
-    place = place.rstrip("，。,.;；：:、")
-    place = re.sub(r"的$", "", place)
-    return place
+    # 从尾部回扫一次: 跳过空白与结尾标点, 再去掉一个 "的", 最后去掉中间空白
+    i = len(place)
+    while i > 0 and (place[i - 1] in _PLACE_TRAILING_CHARS or place[i - 1].isspace()):
+        i -= 1
+    if i > 0 and place[i - 1] == "的":
+        i -= 1
+    return "".join(place[:i].split())
 
 
 def load_local_dotenv(path: Path) -> None:
@@ -133,23 +282,81 @@ def load_local_dotenv(path: Path) -> None:
 
 def mask_url_for_log(url: str) -> str:
     # 屏蔽高德 key
-    masked = re.sub(r"([?&]key=)[^&]+", r"\1***", url)
+    masked = _RE_MASK_KEY.sub(r"\1***", url)
     # 屏蔽彩云 token
-    masked = re.sub(r"/v2(?:\.\d+)?/[^/]+/", "/v2.6/***/", masked)
+    masked = _RE_MASK_V2.sub("/v2.6/***/", masked)
     return masked
 
 
+def _urlopen_get(url: str, timeout: int) -> bytes:
+    req = urllib.request.Request(url, headers=_HTTP_HEADERS)
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return resp.read()
+
+
+def _thread_connections() -> Dict[Tuple[str, str], http.client.HTTPConnection]:
+    connections = getattr(_HTTP_LOCAL, "connections", None)
+    if connections is None:
+        connections = {}
+        _HTTP_LOCAL.connections = connections
+    return connections
+
+
+def http_get(url: str, timeout: int) -> bytes:
+    parts = urllib.parse.urlsplit(url)
+    if urllib.request.getproxies().get(parts.scheme):
+        # 配置了代理时沿用 urllib 的代理处理, 不复用连接
+        return _urlopen_get(url, timeout)
+
+    connections = _thread_connections()
+    key = (parts.scheme, parts.netloc)
+    conn = connections.get(key)
+    if conn is None:
+        conn_cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        conn = conn_cls(parts.netloc, timeout=timeout)
+        connections[key] = conn
+    conn.timeout = timeout
+    if conn.sock is not None:
+        conn.sock.settimeout(timeout)
+
+    path = parts.path or "/"
+    if parts.query:
+        path = f"{path}?{parts.query}"
+    for _ in range(2):
+        reused = conn.sock is not None
+        try:
+            conn.request("GET", path, headers=_HTTP_HEADERS)
+            resp = conn.getresponse()
+            payload = resp.read()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if reused:
+                # 服务端已关闭空闲的长连接: 立即用新连接重发一次, 不占用 fetch_json 的重试与退避
+                continue
+            connections.pop(key, None)
+            raise
+        except (OSError, http.client.HTTPException):
+            # 连接状态未知, 丢弃后由下一次请求重新建立
+            conn.close()
+            connections.pop(key, None)
+            raise
+    if 300 <= resp.status < 400:
+        # 重定向交给 urllib 处理 (与改用长连接之前的行为一致)
+        return _urlopen_get(url, timeout)
+    if resp.status >= 400:
+        raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, None)
+    return payload
+
+
 def fetch_json(url: str, timeout: int, retries: int, debug: bool = False) -> Dict[str, Any]:
     last_error: Optional[Exception] = None
     for attempt in range(retries + 1):
         try:
             if debug:
                 print(f"[debug] GET {mask_url_for_log(url)}")
-            req = urllib.request.Request(url, headers={"User-Agent": "weather-cn-skill-debug/0.1"})
-            with urllib.request.urlopen(req, timeout=timeout) as resp:
-                payload = resp.read().decode("utf-8")
-            return json.loads(payload)
-        except (urllib.error.URLError, TimeoutError, json.JSONDecodeError) as exc:
+            return json_loads(http_get(url, timeout=timeout))
+        except (OSError, http.client.HTTPException, json.JSONDecodeError) as exc:
             last_error = exc
             if attempt < retries:
                 sleep_sec = 0.6 * (2**attempt)
@@ -197,7 +404,8 @@ def build_mock_weather(lng: float, lat: float, days: int, detail: str, hourly_st
     base_temp = 14.0 + (abs(lat) % 5)
     temp_daily = []
     sky_daily = []
-    date_base = datetime.now().date()
+    base_dt = datetime.now().replace(minute=0, second=0, microsecond=0)
+    date_base = base_dt.date()
     sky_cycle = ["CLEAR_DAY", "PARTLY_CLOUDY_DAY", "LIGHT_RAIN", "CLOUDY", "MODERATE_RAIN"]
     for i in range(days):
         day = date_base.fromordinal(date_base.toordinal() + i)
@@ -224,18 +432,17 @@ def build_mock_weather(lng: float, lat: float, days: int, detail: str, hourly_st
         "location": [lng, lat],
     }
     effective_hourly_steps = max(1, min(hourly_steps, 48))
-    now = datetime.now().replace(minute=0, second=0, microsecond=0)
-    hourly_temp = []
-    hourly_sky = []
-    hourly_precip = []
-    for i in range(effective_hourly_steps):
-        dt = now.fromtimestamp(now.timestamp() + i * 3600).isoformat(timespec="minutes")
-        precip_value = round((i % 5) * 0.03, 2)
-        hourly_temp.append({"datetime": dt, "value": round(base_temp + (i % 4) * 0.6, 1)})
-        hourly_sky.append({"datetime": dt, "value": sky_cycle[i % len(sky_cycle)]})
-        hourly_precip.append(
-            {"datetime": dt, "value": precip_value, "probability": int(round(precip_value * 100))}
-        )
+    hourly_dts = [
+        (base_dt + timedelta(hours=i)).isoformat(timespec="minutes") for i in range(effective_hourly_steps)
+    ]
+    hourly_temp = [
+        {"datetime": dt, "value": round(base_temp + (i % 4) * 0.6, 1)} for i, dt in enumerate(hourly_dts)
+    ]
+    hourly_sky = [{"datetime": dt, "value": sky_cycle[i % len(sky_cycle)]} for i, dt in enumerate(hourly_dts)]
+    hourly_precip = [
+        {"datetime": dt, "value": round((i % 5) * 0.03, 2), "probability": (i % 5) * 3}
+        for i, dt in enumerate(hourly_dts)
+    ]
 
     result["result"]["hourly"] = {
         "temperature": hourly_temp,
@@ -297,9 +504,7 @@ def weather_by_caiyun(
 
 
 def skycon_cn(code: Optional[str]) -> str:
-    if not code:
-        return "未知"
-    return SKYCON_MAP.get(code, code)
+    return "未知" if not code else _SKYCON_GET(code, code)
 
 
 def normalize_date(date_text: str) -> str:
@@ -312,9 +517,9 @@ def normalize_datetime(dt_text: str) -> str:
     if not dt_text:
         return dt_text
     text = dt_text.replace("T", " ")
-    m = re.match(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2})", text)
-    if m:
-        return m.group(1)
+    # 形如 "YYYY-MM-DD HH:MM..." 时截取到分钟; 短字符串用下标判断比正则更快
+    if len(text) >= 16 and text[4] == "-" and text[7] == "-" and text[10] == " " and text[13] == ":":
+        return text[:16]
     return text
 
 
@@ -326,6 +531,7 @@ def normalize_probability_percent(value: Any) -> Optional[float]:
     return round(float(value), 1)
 
 
+@functools.lru_cache(maxsize=64)
 def parse_date_safe(date_text: str) -> Optional[date]:
     if not date_text:
         return None
@@ -335,6 +541,7 @@ def parse_date_safe(date_text: str) -> Optional[date]:
         return None
 
 
+@functools.lru_cache(maxsize=64)
 def day_weekday_text(date_text: str) -> str:
     dt = parse_date_safe(date_text)
     if not dt:
@@ -342,8 +549,8 @@ def day_weekday_text(date_text: str) -> str:
     return WEEKDAY_CN[dt.weekday()]
 
 
-def extract_realtime(weather_data: Dict[str, Any]) -> Dict[str, Any]:
-    realtime = ((weather_data.get("result") or {}).get("realtime") or {})
+def extract_realtime(result: Dict[str, Any]) -> Dict[str, Any]:
+    realtime = result.get("realtime") or {}
     air_quality = realtime.get("air_quality") if isinstance(realtime, dict) else {}
     aqi = air_quality.get("aqi") if isinstance(air_quality, dict) else {}
     humidity = realtime.get("humidity") if isinstance(realtime, dict) else None
@@ -363,47 +570,57 @@ def extract_realtime(weather_data: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def extract_minutely_summary(weather_data: Dict[str, Any]) -> Dict[str, Any]:
-    minutely = ((weather_data.get("result") or {}).get("minutely") or {})
+def extract_minutely_summary(result: Dict[str, Any]) -> Dict[str, Any]:
+    minutely = result.get("minutely") or {}
     probs = minutely.get("probability") or []
-    numeric_probs = [p for p in probs if isinstance(p, (int, float))]
-    max_prob = round(max(numeric_probs), 3) if numeric_probs else None
+    max_prob = None
+    if probs:
+        try:
+            # 上游通常是纯数值列表, 直接取最大值
+            max_prob = round(max(probs), 3)
+        except TypeError:
+            numeric_max = max((p for p in probs if isinstance(p, (int, float))), default=None)
+            max_prob = round(numeric_max, 3) if numeric_max is not None else None
     return {
         "description": minutely.get("description"),
         "max_probability": max_prob,
     }
 
 
-def extract_hourly_forecast(weather_data: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
-    hourly = ((weather_data.get("result") or {}).get("hourly") or {})
-    temps = hourly.get("temperature") or []
+def extract_hourly_forecast(result: Dict[str, Any], limit: int) -> List[Dict[str, Any]]:
+    if limit <= 0:
+        return []
+    hourly = result.get("hourly") or {}
+    temps = hourly.get("temperature")
+    if not temps:
+        return []
     sky = hourly.get("skycon") or []
     precip = hourly.get("precipitation") or []
-    result: List[Dict[str, Any]] = []
+    sky_get = _SKYCON_GET
+    forecast: List[Dict[str, Any]] = []
     n = min(limit, len(temps))
-    for i in range(n):
-        t = temps[i] if isinstance(temps[i], dict) else {}
-        s = sky[i] if i < len(sky) and isinstance(sky[i], dict) else {}
-        p = precip[i] if i < len(precip) and isinstance(precip[i], dict) else {}
-        result.append(
+    rows = itertools.islice(itertools.zip_longest(temps, sky, precip, fillvalue={}), n)
+    for i, (t, s, p) in enumerate(rows):
+        t = t if type(t) is dict else {}
+        s = s if type(s) is dict else {}
+        p = p if type(p) is dict else {}
+        sky_code = s.get("value")
+        forecast.append(
             {
                 "datetime": normalize_datetime(
                     t.get("datetime") or s.get("datetime") or p.get("datetime") or f"H+{i}"
                 ),
                 "temperature": t.get("value"),
-                "skycon": skycon_cn(s.get("value")),
+                "skycon": sky_get(sky_code, sky_code) if sky_code else "未知",
                 "precipitation": p.get("value"),
                 "precipitation_probability": normalize_probability_percent(p.get("probability")),
             }
         )
-    return result
+    return forecast
 
 
-def extract_alerts(weather_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-    result_part = weather_data.get("result") or {}
-    alert_root = result_part.get("alert") if isinstance(result_part, dict) else None
-    if not alert_root:
-        alert_root = weather_data.get("alert") or {}
+def extract_alerts(result: Dict[str, Any], fallback_alert: Any = None) -> List[Dict[str, Any]]:
+    alert_root = result.get("alert") or fallback_alert or {}
     content = alert_root.get("content") if isinstance(alert_root, dict) else []
     if not isinstance(content, list):
         return []
@@ -423,8 +640,8 @@ def extract_alerts(weather_data: Dict[str, Any]) -> List[Dict[str, Any]]:
     return alerts
 
 
-def extract_life_index_summary(weather_data: Dict[str, Any]) -> Dict[str, Any]:
-    daily = ((weather_data.get("result") or {}).get("daily") or {})
+def extract_life_index_summary(result: Dict[str, Any]) -> Dict[str, Any]:
+    daily = result.get("daily") or {}
     life_index = daily.get("life_index") or {}
     if not isinstance(life_index, dict):
         return {}
@@ -440,24 +657,28 @@ def extract_life_index_summary(weather_data: Dict[str, Any]) -> Dict[str, Any]:
     return summary
 
 
-def extract_daily_forecast(weather_data: Dict[str, Any], days: int) -> List[Dict[str, Any]]:
-    daily = ((weather_data.get("result") or {}).get("daily") or {})
+def extract_daily_forecast(result: Dict[str, Any], days: int) -> List[Dict[str, Any]]:
+    daily = result.get("daily") or {}
     temps = daily.get("temperature") or []
     sky = daily.get("skycon") or []
-    result = []
+    sky_get = _SKYCON_GET
+    forecast: List[Dict[str, Any]] = []
     limit = min(days, len(temps))
-    for i in range(limit):
-        t = temps[i] if isinstance(temps[i], dict) else {}
-        s = sky[i] if i < len(sky) and isinstance(sky[i], dict) else {}
-        result.append(
+    rows = itertools.islice(itertools.zip_longest(temps, sky, fillvalue={}), limit)
+    for i, (t, s) in enumerate(rows):
+        t = t if type(t) is dict else {}
+        s = s if type(s) is dict else {}
+        sky_code = s.get("value")
+        forecast.append(
             {
-                "date": normalize_date((t.get("date") or s.get("date") or f"D+{i}")),
+                # 内联 normalize_date
+                "date": (t.get("date") or s.get("date") or f"D+{i}").split("T", 1)[0],
                 "min": t.get("min"),
                 "max": t.get("max"),
-                "skycon": skycon_cn(s.get("value")),
+                "skycon": sky_get(sky_code, sky_code) if sky_code else "未知",
             }
         )
-    return result
+    return forecast
 
 
 def build_output_payload(
@@ -468,26 +689,29 @@ def build_output_payload(
     weather_data: Dict[str, Any],
     include_raw: bool,
 ) -> Dict[str, Any]:
+    result = weather_data.get("result") or {}
+    if not isinstance(result, dict):
+        result = {}
     payload: Dict[str, Any] = {
         "query_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "place": place,
         "resolved_address": geo.get("resolved_address") or place,
         "coord": {"lng": geo.get("lng"), "lat": geo.get("lat")},
         "days": days,
-        "realtime": extract_realtime(weather_data),
-        "daily": extract_daily_forecast(weather_data, max(days, 1)),
+        "realtime": extract_realtime(result),
+        "daily": extract_daily_forecast(result, max(days, 1)),
     }
     hourly_limit = 24 if detail == "full" else 6
-    hourly = extract_hourly_forecast(weather_data, limit=hourly_limit)
+    hourly = extract_hourly_forecast(result, limit=hourly_limit)
     if hourly:
         payload["hourly"] = hourly
 
     if detail == "full":
-        payload["minutely"] = extract_minutely_summary(weather_data)
-        alerts = extract_alerts(weather_data)
+        payload["minutely"] = extract_minutely_summary(result)
+        alerts = extract_alerts(result, fallback_alert=weather_data.get("alert"))
         if alerts:
             payload["alerts"] = alerts
-        life_index = extract_life_index_summary(weather_data)
+        life_index = extract_life_index_summary(result)
         if life_index:
             payload["life_index"] = life_index
 
@@ -514,16 +738,27 @@ def print_output(
         include_raw=include_raw,
     )
     if output_format == "json":
-        print(json.dumps(payload, ensure_ascii=False, indent=2))
+        data = json_dumps(payload, indent=True)
+        buffer = getattr(sys.stdout, "buffer", None)
+        if buffer is None:
+            # stdout 被替换为纯文本流 (如库调用方重定向) 时退回 str 写入
+            sys.stdout.write(data.decode("utf-8") + "\n")
+            return
+        # 先冲刷已缓冲的 debug 文本, 再直接写 UTF-8 字节, 省去一次 str 往返
+        sys.stdout.flush()
+        buffer.write(data)
+        buffer.write(b"\n")
         return
 
     # Telegram-friendly text format: bold titles + bullets + code block
     now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
     resolved = geo.get("resolved_address") or place
+    # 先拼好全部行, 最后一次性写出
+    out: List[str] = []
 
-    print(f"**{resolved}｜天气**")
-    print(f"`查询时间 {now_str}`")
-    print("")
+    out.append(f"**{resolved}｜天气**")
+    out.append(f"`查询时间 {now_str}`")
+    out.append("")
 
     realtime = payload.get("realtime") or {}
     daily = payload.get("daily") or []
@@ -531,124 +766,119 @@ def print_output(
     # Keep the message compact by default (TG-friendly)
     daily_show = daily[:3]
     day_title = f"近 {len(daily_show)} 日" if len(daily_show) else "近几日"
-    print(f"**{day_title}**")
+    out.append(f"**{day_title}**")
     for day in daily_show:
         day_date = day.get("date", "")
         weekday = day_weekday_text(day_date)
         weekday_text = weekday if weekday else day_date
-        print(
+        out.append(
             f"• {weekday_text} {day.get('skycon')}  "
             f"{day.get('min', '--')}～{day.get('max', '--')}°C"
         )
-    print("")
+    out.append("")
 
     if realtime:
         temp = realtime.get("temperature", "--")
         feel = realtime.get("apparent_temperature", "--")
         hum = realtime.get("humidity_percent", "--")
-        print("**当前**")
-        print(f"• {temp}°C（体感 {feel}°C）｜湿度 {hum}%")
-        print("")
+        out.append("**当前**")
+        out.append(f"• {temp}°C（体感 {feel}°C）｜湿度 {hum}%")
+        out.append("")
 
     hourly = payload.get("hourly") or []
     if hourly:
-        print("**未来 6 小时**")
-        print("```text")
+        out.append("**未来 6 小时**")
+        out.append("```text")
         for item in hourly[:6]:
             # datetime like: 2026-02-26 10:00 → 10:00
             dt_text = item.get("datetime") or ""
-            hhmm = dt_text[-5:] if re.match(r".*\d{2}:\d{2}$", dt_text) else dt_text
+            hhmm = dt_text[-5:] if _RE_HHMM_TAIL.search(dt_text) else dt_text
 
             sky = item.get("skycon") or "--"
             tval = item.get("temperature")
-            t_text = f"{tval:.2f}°C" if isinstance(tval, (int, float)) else f"{tval}°C"
+            t_text = f"{tval:.2f}°C" if type(tval) in (int, float) else f"{tval}°C"
 
             p_prob = item.get("precipitation_probability")
             p_amount = item.get("precipitation")
-            p_prob_text = f"{int(round(p_prob))}%" if isinstance(p_prob, (int, float)) else "--"
-            p_amount_text = f"{p_amount:.2f}" if isinstance(p_amount, (int, float)) else "--"
+            p_prob_text = f"{p_prob:.0f}%" if type(p_prob) in (int, float) else "--"
+            p_amount_text = f"{p_amount:.2f}" if type(p_amount) in (int, float) else "--"
 
             # Align for readability in monospace
-            print(f"{hhmm:>5}  {sky:<2}  {t_text:<8}  降水 {p_prob_text:>3}  {p_amount_text} mm/h")
-        print("```")
+            out.append(f"{hhmm:>5}  {sky:<2}  {t_text:<8}  降水 {p_prob_text:>3}  {p_amount_text} mm/h")
+        out.append("```")
 
     if detail == "full":
         if realtime.get("aqi_chn") is not None or realtime.get("pm25") is not None:
-            print(f"空气质量: AQI(国标) {realtime.get('aqi_chn', '--')}, PM2.5 {realtime.get('pm25', '--')}")
+            out.append(f"空气质量: AQI(国标) {realtime.get('aqi_chn', '--')}, PM2.5 {realtime.get('pm25', '--')}")
         minutely = payload.get("minutely") or {}
         if minutely.get("description") or minutely.get("max_probability") is not None:
             max_prob = minutely.get("max_probability")
             max_prob_text = f"{round(max_prob * 100)}%" if isinstance(max_prob, (int, float)) else "--"
-            print(f"分钟级降雨: {minutely.get('description', '无')} (最大概率 {max_prob_text})")
+            out.append(f"分钟级降雨: {minutely.get('description', '无')} (最大概率 {max_prob_text})")
         alerts = payload.get("alerts") or []
         if alerts:
-            print(f"⚠️ 天气预警: {len(alerts)} 条")
+            out.append(f"⚠️ 天气预警: {len(alerts)} 条")
             for item in alerts[:3]:
-                print(f"  {item.get('title')} ({item.get('status', '未知状态')})")
+                out.append(f"  {item.get('title')} ({item.get('status', '未知状态')})")
 
+    sys.stdout.write("\n".join(out) + "\n")
 
-def main() -> int:
-    # Load .env in a robust way:
+
+@functools.lru_cache(maxsize=None)
+def load_skill_dotenv() -> None:
+    # Load .env in a robust way (only once, and only when an API call is needed):
     # 1) Skill-local .env (relative to this script): <skill_root>/.env
     # 2) Current working directory .env (allows override in ad-hoc runs)
     script_env = (Path(__file__).resolve().parent.parent / ".env")
     load_local_dotenv(script_env)
     load_local_dotenv(Path(".env"))
 
-    parser = argparse.ArgumentParser(
-        description="中国天气查询调试脚本（高德地理编码 + 彩云天气）",
-        formatter_class=argparse.RawTextHelpFormatter,
-    )
-    parser.add_argument("place", help="位置描述，例: 北京市朝阳区")
-    parser.add_argument("--cache-dir", default="cache", help="缓存目录 (默认: ./cache)")
-    parser.add_argument("--geo-ttl-hours", type=int, default=24 * 30, help="地名坐标缓存小时数")
-    parser.add_argument("--weather-ttl-minutes", type=int, default=10, help="天气缓存分钟数")
-    parser.add_argument("--timeout", type=int, default=8, help="HTTP 超时时间(秒)")
-    parser.add_argument("--retries", type=int, default=2, help="HTTP 重试次数")
-    parser.add_argument("--amap-key", default=os.getenv("AMAP_API_KEY", ""), help="高德 API Key")
-    parser.add_argument("--caiyun-token", default=os.getenv("CAIYUN_API_TOKEN", ""), help="彩云 API Token")
-    parser.add_argument("--detail", choices=["basic", "full"], default="basic", help="输出详情级别")
-    parser.add_argument("--format", choices=["text", "json"], default="text", help="输出格式")
-    parser.add_argument("--hourly-steps", type=int, default=24, help="小时级步数 1-360 (full 模式生效)")
-    parser.add_argument("--raw-caiyun", action="store_true", help="json 输出时附加原始彩云响应")
-    parser.add_argument("--mock", action="store_true", help="离线调试模式，不发起外网请求")
-    parser.add_argument("--debug", action="store_true", help="打印调试日志")
-
-    args = parser.parse_args()
 
-    place = normalize_place(args.place)
+def _run(config: Dict[str, Any]) -> int:
+    cfg = {**DEFAULT_CONFIG, **config}
+    place = normalize_place(cfg["place"])
     days = DEFAULT_DAYS
+    detail = cfg["detail"]
+    debug = cfg["debug"]
+    mock = cfg["mock"]
+    getenv = os.getenv
 
     if not place:
         raise SystemExit("place 不能为空")
     if days < 1 or days > 15:
         raise SystemExit(f"内部配置错误: DEFAULT_DAYS={days} 超出 1~15")
-    if args.hourly_steps < 1 or args.hourly_steps > 360:
+    if cfg["hourly_steps"] < 1 or cfg["hourly_steps"] > 360:
         raise SystemExit("hourly-steps 必须在 1~360 之间")
-    effective_hourly_steps = args.hourly_steps if args.detail == "full" else 6
-
-    if not args.mock and not args.amap_key:
-        raise SystemExit("缺少高德 Key，请设置 AMAP_API_KEY 或 --amap-key")
-    if not args.mock and not args.caiyun_token:
-        raise SystemExit("缺少彩云 Token，请设置 CAIYUN_API_TOKEN 或 --caiyun-token")
-
-    cache_dir = Path(args.cache_dir)
-    geo_cache = JsonCache(cache_dir / "geocode.json")
-    weather_cache = JsonCache(cache_dir / "weather.json")
-    cache_namespace = "mock" if args.mock else "live"
+    effective_hourly_steps = cfg["hourly_steps"] if detail == "full" else 6
+
+    cache_dir = Path(cfg["cache_dir"])
+    geo_db = open_cache_db(cache_dir / "cache.db")
+    weather_db = geo_db
+    if cfg["weather_cache_dir"]:
+        weather_cache_dir = Path(cfg["weather_cache_dir"])
+        if weather_cache_dir.resolve() != cache_dir.resolve():
+            weather_db = open_cache_db(weather_cache_dir / "cache.db", durable=not is_tmpfs_path(weather_cache_dir))
+    else:
+        shm_dir = default_weather_cache_dir()
+        if shm_dir is not None:
+            # 默认的共享内存目录不可用时退回 --cache-dir
+            weather_db = open_cache_db(shm_dir / "cache.db", durable=not is_tmpfs_path(shm_dir)) or geo_db
+    geo_cache = SqliteCache(geo_db, debug=debug)
+    weather_cache = SqliteCache(weather_db, debug=debug)
+    cache_namespace = "mock" if mock else "live"
 
     geo_key = f"{cache_namespace}:amap:{place}"
-    geo_ttl_seconds = args.geo_ttl_hours * 3600
-    weather_ttl_seconds = args.weather_ttl_minutes * 60
+    geo_ttl_seconds = cfg["geo_ttl_hours"] * 3600
+    weather_ttl_seconds = cfg["weather_ttl_minutes"] * 60
 
     geo = geo_cache.get(geo_key, geo_ttl_seconds)
     if geo:
-        if args.debug:
+        if debug:
             print(f"[debug] geocode cache hit: {geo_key}")
     else:
-        if args.debug:
+        if debug:
             print(f"[debug] geocode cache miss: {geo_key}")
-        if args.mock:
+        if mock:
             geo = {
                 "query_place": place,
                 "resolved_address": place,
@@ -656,49 +886,103 @@ def main() -> int:
                 "lat": 39.90923,
             }
         else:
+            load_skill_dotenv()
+            amap_key = cfg["amap_key"] or getenv("AMAP_API_KEY", "")
+            if not amap_key:
+                raise SystemExit("缺少高德 Key，请设置 AMAP_API_KEY 或 --amap-key")
             geo = geocode_by_amap(
                 place=place,
-                amap_key=args.amap_key,
-                timeout=args.timeout,
-                retries=args.retries,
-                debug=args.debug,
+                amap_key=amap_key,
+                timeout=cfg["timeout"],
+                retries=cfg["retries"],
+                debug=debug,
             )
         geo_cache.set(geo_key, geo)
 
     weather_key = f"{cache_namespace}:caiyun:{geo['lng']:.6f},{geo['lat']:.6f}:d{days}"
-    weather_key = f"{weather_key}:detail{args.detail}:h{effective_hourly_steps}"
+    weather_key = f"{weather_key}:detail{detail}:h{effective_hourly_steps}"
     weather = weather_cache.get(weather_key, weather_ttl_seconds)
     if weather:
-        if args.debug:
+        if debug:
             print(f"[debug] weather cache hit: {weather_key}")
     else:
-        if args.debug:
+        if debug:
             print(f"[debug] weather cache miss: {weather_key}")
+        caiyun_token = ""
+        if not mock:
+            load_skill_dotenv()
+            caiyun_token = cfg["caiyun_token"] or getenv("CAIYUN_API_TOKEN", "")
+            if not caiyun_token:
+                raise SystemExit("缺少彩云 Token，请设置 CAIYUN_API_TOKEN 或 --caiyun-token")
         weather = weather_by_caiyun(
             lng=float(geo["lng"]),
             lat=float(geo["lat"]),
             days=days,
-            detail=args.detail,
+            detail=detail,
             hourly_steps=effective_hourly_steps,
-            token=args.caiyun_token,
-            timeout=args.timeout,
-            retries=args.retries,
-            debug=args.debug,
-            mock=args.mock,
+            token=caiyun_token,
+            timeout=cfg["timeout"],
+            retries=cfg["retries"],
+            debug=debug,
+            mock=mock,
         )
         weather_cache.set(weather_key, weather)
 
     print_output(
         place=place,
         days=days,
-        detail=args.detail,
-        output_format=args.format,
-        include_raw=args.raw_caiyun,
+        detail=detail,
+        output_format=cfg["format"],
+        include_raw=cfg["raw_caiyun"],
         geo=geo,
         weather_data=weather,
     )
     return 0
 
 
+def main() -> int:
+    # argparse 只在命令行入口需要, 库调用方直接使用 _run(config)
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="中国天气查询调试脚本（高德地理编码 + 彩云天气）",
+        formatter_class=argparse.RawTextHelpFormatter,
+    )
+    parser.add_argument("place", help="位置描述，例: 北京市朝阳区")
+    parser.add_argument("--cache-dir", default=DEFAULT_CONFIG["cache_dir"], help="缓存目录 (默认: ./cache)")
+    parser.add_argument(
+        "--weather-cache-dir",
+        default=DEFAULT_CONFIG["weather_cache_dir"],
+        help="天气缓存目录 (默认: /dev/shm/weather-cn-<uid>，不可用时同 --cache-dir)",
+    )
+    parser.add_argument(
+        "--geo-ttl-hours", type=int, default=DEFAULT_CONFIG["geo_ttl_hours"], help="地名坐标缓存小时数"
+    )
+    parser.add_argument(
+        "--weather-ttl-minutes", type=int, default=DEFAULT_CONFIG["weather_ttl_minutes"], help="天气缓存分钟数"
+    )
+    parser.add_argument("--timeout", type=int, default=DEFAULT_CONFIG["timeout"], help="HTTP 超时时间(秒)")
+    parser.add_argument("--retries", type=int, default=DEFAULT_CONFIG["retries"], help="HTTP 重试次数")
+    # Key/Token 默认留空: 需要调用接口时才在加载 .env 之后从环境变量读取 (见 _run)
+    parser.add_argument("--amap-key", default="", help="高德 API Key (默认读取 AMAP_API_KEY)")
+    parser.add_argument("--caiyun-token", default="", help="彩云 API Token (默认读取 CAIYUN_API_TOKEN)")
+    parser.add_argument(
+        "--detail", choices=["basic", "full"], default=DEFAULT_CONFIG["detail"], help="输出详情级别"
+    )
+    parser.add_argument("--format", choices=["text", "json"], default=DEFAULT_CONFIG["format"], help="输出格式")
+    parser.add_argument(
+        "--hourly-steps",
+        type=int,
+        default=DEFAULT_CONFIG["hourly_steps"],
+        help="小时级步数 1-360 (full 模式生效)",
+    )
+    parser.add_argument("--raw-caiyun", action="store_true", help="json 输出时附加原始彩云响应")
+    parser.add_argument("--mock", action="store_true", help="离线调试模式，不发起外网请求")
+    parser.add_argument("--debug", action="store_true", help="打印调试日志")
+
+    args = parser.parse_args()
+    return _run(vars(args))
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,43 @@
+"""SqliteCache / open_cache_db 测试."""
+
+from __future__ import annotations
+
+import contextlib
+import io
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import weather_cn  # noqa: E402
+
+
+class OpenCacheDbTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "cache.db"
+
+    def test_rebuilds_corrupt_database(self) -> None:
+        self.path.write_bytes(b"garbage")
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            conn = weather_cn.open_cache_db(self.path)
+        self.assertIsNotNone(conn)
+        self.addCleanup(conn.close)
+        self.assertIn("[warn]", stderr.getvalue())
+
+        cache = weather_cn.SqliteCache(conn)
+        cache.set("k", {"v": 1})
+        self.assertEqual(cache.get("k", ttl_seconds=60), {"v": 1})
+
+    def test_cache_without_connection_is_noop(self) -> None:
+        cache = weather_cn.SqliteCache(None)
+        cache.set("k", {"v": 1})
+        self.assertIsNone(cache.get("k", ttl_seconds=60))
+
+
+if __name__ == "__main__":
+    unittest.main()
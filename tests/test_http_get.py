@@ -0,0 +1,70 @@
+"""http_get / fetch_json 长连接复用测试 (本地 HTTP 服务, 不访问外网)."""
+
+from __future__ import annotations
+
+import http.server
+import json
+import sys
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "scripts"))
+
+import weather_cn  # noqa: E402
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 为 True 时响应后直接断开, 但不发送 "Connection: close", 模拟服务端回收空闲长连接
+    close_after_response = False
+
+    def do_GET(self) -> None:
+        body = json.dumps({"path": self.path, "port": self.client_address[1]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.close_after_response:
+            self.close_connection = True
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+class _ClosingHandler(_Handler):
+    close_after_response = True
+
+
+class HttpGetTest(unittest.TestCase):
+    def _serve(self, handler: type) -> str:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(weather_cn._thread_connections().clear)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def test_reuses_keep_alive_connection(self) -> None:
+        base = self._serve(_Handler)
+        first = weather_cn.fetch_json(f"{base}/a", timeout=5, retries=0)
+        second = weather_cn.fetch_json(f"{base}/b?x=1", timeout=5, retries=0)
+        self.assertEqual(second["path"], "/b?x=1")
+        self.assertEqual(first["port"], second["port"])
+
+    def test_reconnects_when_server_closed_idle_connection(self) -> None:
+        base = self._serve(_ClosingHandler)
+        with mock.patch.object(weather_cn.time, "sleep") as sleep:
+            first = weather_cn.fetch_json(f"{base}/a", timeout=5, retries=0)
+            second = weather_cn.fetch_json(f"{base}/b", timeout=5, retries=0)
+        self.assertEqual(second["path"], "/b")
+        self.assertNotEqual(first["port"], second["port"])
+        sleep.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()